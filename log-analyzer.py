@@ -1,12 +1,19 @@
 import argparse
-import requests
-import yaml
+import functools
 import logging
-from dotenv import load_dotenv
+import io
+import mmap
+import orjson
 import os
-from openai import OpenAI
+import shutil
+import subprocess
+import sys
+from collections import OrderedDict, deque
 from datetime import datetime
 
+# asyncio, requests, httpx, openai, yaml and dotenv are slow to import, so
+# they are imported lazily by the code paths that need them
+
 # Configure logging to go to a file, not the console
 logging.basicConfig(
     filename='log-analyzer.log',
@@ -15,57 +22,381 @@ logging.basicConfig(
     format='%(asctime)s [%(levelname)s] %(message)s',
     datefmt='%Y-%m-%d %H:%M:%S'
 )
+log = logging.getLogger(__name__)
 
-def call_ollama(full_prompt, model, ip, port):
-    OLLAMA_URL = f"http://{ip}:{port}/api/generate"
-    data = {
+SEP = "=" * 60
+
+# Fail fast when the server is unreachable, but allow slow generations
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 300
+
+OLLAMA_HEADERS = {"Content-Type": "application/json"}
+
+# Most concurrent -k requests sent to either server. Ollama answers only a
+# few requests at a time (OLLAMA_NUM_PARALLEL) and queues the rest, and that
+# queue time counts against READ_TIMEOUT; OpenAI answers bursts with 429 rate
+# limit errors. The remaining windows wait on our side instead
+MAX_PARALLEL_REQUESTS = 4
+
+# Error bodies are logged and printed only up to this many bytes
+MAX_LOGGED_BODY = 2048
+
+def truncate_body(data):
+    return data[:MAX_LOGGED_BODY].decode('utf-8', errors='replace')
+
+@functools.cache
+def get_session():
+    # Reuse pooled keep-alive connections across requests to the LLM servers
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=Retry(total=2, connect=2, backoff_factor=0.5)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def new_openai_http_client():
+    # Not cached: an AsyncClient's pool is bound to the event loop it is first
+    # used on, so each asyncio.run() opens (and closes) its own client.
+    # HTTP/2 lets concurrent requests share one TLS connection
+    import httpx
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+
+@functools.cache
+def get_openai_api_key():
+    # Parse .env once and reuse the key for every OpenAI call
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.environ.get("OPENAI_API_KEY")
+
+@functools.cache
+def yaml_safe_loader():
+    # Use the libyaml C loader when PyYAML was built with it
+    import yaml
+    try:
+        return yaml.CSafeLoader
+    except AttributeError:
+        return yaml.SafeLoader
+
+# Parsed YAML files keyed by path, holding (mtime, size, data)
+_YAML_CACHE = OrderedDict()
+_YAML_CACHE_MAX = 100
+
+def load_yaml_cached(path):
+    st = os.stat(path)
+    key = os.path.abspath(path)
+    cached = _YAML_CACHE.get(key)
+    if cached and cached[0] == st.st_mtime and cached[1] == st.st_size:
+        _YAML_CACHE.move_to_end(key)
+        return cached[2]
+
+    # Try the JSON sidecar left by a previous run before parsing the YAML
+    json_path = path + '.cache.json'
+    data = None
+    try:
+        with open(json_path, 'rb') as f:
+            sidecar = orjson.loads(f.read())
+        if sidecar["mtime"] == st.st_mtime and sidecar["size"] == st.st_size:
+            data = sidecar["data"]
+    except (OSError, orjson.JSONDecodeError, KeyError, TypeError):
+        pass
+
+    if data is None:
+        import yaml
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.load(f, Loader=yaml_safe_loader())
+        try:
+            sidecar = orjson.dumps(
+                {"mtime": st.st_mtime, "size": st.st_size, "data": data}
+            )
+            # orjson encodes dates and datetimes as strings, so only cache
+            # configs that come back from JSON unchanged
+            if orjson.loads(sidecar)["data"] == data:
+                with open(json_path, 'wb') as f:
+                    f.write(sidecar)
+            else:
+                log.debug("Config %s is not JSON round-trippable, not caching",
+                          path)
+        except (OSError, TypeError) as e:
+            log.warning("Could not write config cache %s: %s", json_path, e)
+
+    _YAML_CACHE[key] = (st.st_mtime, st.st_size, data)
+    _YAML_CACHE.move_to_end(key)
+    if len(_YAML_CACHE) > _YAML_CACHE_MAX:
+        _YAML_CACHE.popitem(last=False)
+    return data
+
+def tail_lines(path, n):
+    # Prefer the system tail binary, falling back to the Python version
+    # where it is missing (e.g. on Windows) or fails
+    if n <= 0:
+        return []
+    tail = shutil.which('tail')
+    if tail and os.path.isfile(path):
+        try:
+            out = subprocess.check_output([tail, '-n', str(n), '--', path],
+                                          stderr=subprocess.PIPE)
+            return out.decode('utf-8').splitlines()[-n:]
+        except OSError as e:
+            log.warning("tail failed on %s, reading in Python: %s", path, e)
+        except subprocess.CalledProcessError as e:
+            # Keep tail's own message out of the console; Python reports the
+            # error itself if the file really cannot be read
+            log.warning("tail failed on %s, reading in Python: %s",
+                        path, e.stderr.decode('utf-8', errors='replace').strip())
+    return _tail_lines_python(path, n)
+
+def _tail_lines_python(path, n):
+    # Map the file and scan backwards for newlines, so only the pages holding
+    # the last n lines are read and nothing before them is copied
+    with open(path, 'rb') as f:
+        if not f.seekable():
+            # Pipes and FIFOs: stream forward, keeping only the last n lines
+            text = io.TextIOWrapper(f, encoding='utf-8')
+            return [line.rstrip('\n') for line in deque(text, maxlen=n)]
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.size()
+            for _ in range(n + 1):
+                pos = mm.rfind(b'\n', 0, pos)
+                if pos == -1:
+                    break
+            data = mm[pos + 1:]
+    return data.decode('utf-8').splitlines()[-n:]
+
+def ollama_url(ip, port):
+    return f"http://{ip}:{port}/api/generate"
+
+def ollama_body(full_prompt, model, stream):
+    # Serialized once up front, so retries resend the same bytes instead of
+    # re-encoding the (possibly large) prompt
+    return orjson.dumps({
         "model": model,
         "prompt": full_prompt,
-        "stream": False,
+        "stream": stream,
         "temperature": 0,
         "max_tokens": 4096  # Assuming 4096 is the max tokens for Ollama
-    }
-    headers = {"Content-Type": "application/json"}
-    return requests.post(OLLAMA_URL, json=data, headers=headers, timeout=300)
-
-def call_openai(full_prompt, model):
-    OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-    if not OPENAI_API_KEY:
-        logging.error("OpenAI API key not found in .env file.")
+    })
+
+def call_ollama(full_prompt, model, ip, port):
+    body = ollama_body(full_prompt, model, stream=True)
+    return get_session().post(ollama_url(ip, port), data=body,
+                              headers=OLLAMA_HEADERS,
+                              timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                              stream=True)
+
+async def ollama_generate(client, semaphore, full_prompt, model, ip, port):
+    # Non-streaming request used when several windows are analyzed at once
+    body = ollama_body(full_prompt, model, stream=False)
+    async with semaphore:
+        response = await client.post(ollama_url(ip, port), content=body,
+                                     headers=OLLAMA_HEADERS)
+    if response.status_code != 200:
+        log.error("Error: %d - %s", response.status_code,
+                  truncate_body(response.content))
+        return None
+    resp_data = orjson.loads(response.content)
+    if "response" not in resp_data:
+        log.warning("No valid response field found.")
+        return None
+    return resp_data["response"]
+
+async def ollama_generate_all(prompts, model, ip, port):
+    import asyncio
+    import httpx
+    parallel = min(len(prompts), MAX_PARALLEL_REQUESTS)
+    semaphore = asyncio.Semaphore(parallel)
+    limits = httpx.Limits(max_connections=parallel,
+                          max_keepalive_connections=parallel)
+    timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        return await asyncio.gather(
+            *[ollama_generate(client, semaphore, p, model, ip, port)
+              for p in prompts],
+            return_exceptions=True
+        )
+
+def stream_ollama_response(response):
+    # Print tokens as they arrive and return the full answer, or None if
+    # the stream reported an error or contained no response field
+    parts = []
+    found = False
+    for line in response.iter_lines():
+        if not line:
+            continue
+        chunk = orjson.loads(line)
+        if "error" in chunk:
+            # Do not hand back a partial answer as if it were complete
+            log.error("Ollama stream error: %s", chunk["error"])
+            print(f"\nOllama stream error: {chunk['error']}\n")
+            response.close()
+            return None
+        if "response" in chunk:
+            found = True
+            parts.append(chunk["response"])
+            sys.stdout.write(chunk["response"])
+            sys.stdout.flush()
+        if chunk.get("done"):
+            log.debug("Final stream chunk: %s", chunk)
+            break
+    response.close()
+    if not found:
+        log.warning("No valid response field found.")
+        print("\nNo valid response field found in the JSON.\n")
+        return None
+    return "".join(parts)
+
+def print_response_header(title="LLM RESPONSE:"):
+    print("\n" + SEP)
+    print(title)
+    print(SEP)
+
+async def call_openai(full_prompt, model, api_key, http_client):
+    # Yield the answer's content deltas as the stream arrives
+    import httpx
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(
+        api_key=api_key,
+        http_client=http_client,
+        timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+    )
+    stream = await client.chat.completions.create(
+        messages=[{"role": "user", "content": full_prompt}],
+        model=model,
+        max_tokens=4096,
+        temperature=0,
+        stream=True
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def stream_openai_response(full_prompt, model, api_key):
+    # Print tokens as they arrive and return the full answer, or None on error
+    if not api_key:
+        log.error("OpenAI API key not found in .env file.")
         print("\nOpenAI API key not found in .env file.\n")
         return None
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
+    parts = []
     try:
-        response = client.chat.completions.create(
-            messages=[{"role": "user", "content": full_prompt}],
-            model=model,
-            max_tokens=4096,
-            temperature=0
-        )
-        return response
+        async with new_openai_http_client() as http_client:
+            async for token in call_openai(full_prompt, model, api_key,
+                                           http_client):
+                if not parts:
+                    print_response_header()
+                parts.append(token)
+                sys.stdout.write(token)
+                sys.stdout.flush()
     except Exception as e:
-        logging.error("OpenAI API call error: %s", e)
+        log.error("OpenAI API call error: %s", e)
         print(f"\nOpenAI API call error: {e}\n")
         return None
 
-def save_response_to_file(filename, log_filename, num_lines, system, model, answer):
-    with open(filename, 'a', encoding='utf-8') as f:
-        f.write(f"Datetime: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"Log Filename: {log_filename}\n")
-        f.write(f"Number of Lines Analyzed: {num_lines}\n")
-        f.write(f"System: {system}\n")
-        f.write(f"Model: {model}\n")
-        f.write(f"Answer:\n{answer}\n")
-        f.write("="*60 + "\n\n")
+    if not parts:
+        log.warning("No valid response field found.")
+        print("\nNo valid response field found in the JSON.\n")
+        return None
+    return "".join(parts)
 
-def main():
-    logging.info("# Starting LLM log analyzer")
-    print('Starting the LLM log analyzer')
+async def openai_complete(full_prompt, model, api_key, http_client, semaphore):
+    # Collect a whole answer without printing, for concurrent window analysis
+    try:
+        async with semaphore:
+            parts = [
+                token async for token in
+                call_openai(full_prompt, model, api_key, http_client)
+            ]
+    except Exception as e:
+        log.error("OpenAI API call error: %s", e)
+        return None
+    if not parts:
+        log.warning("No valid response field found.")
+        return None
+    return "".join(parts)
 
-    # Load environment variables from .env file
-    load_dotenv()
+async def openai_complete_all(prompts, model, api_key):
+    import asyncio
+    semaphore = asyncio.Semaphore(min(len(prompts), MAX_PARALLEL_REQUESTS))
+    async with new_openai_http_client() as http_client:
+        return await asyncio.gather(
+            *[openai_complete(p, model, api_key, http_client, semaphore)
+              for p in prompts],
+            return_exceptions=True
+        )
+
+def analyze_windows(args, prompt, lines):
+    # Split the lines into consecutive N-line windows aligned to the end of
+    # the file, oldest first, and send one prompt per window concurrently
+    import asyncio
+
+    windows = [
+        lines[max(i - args.n, 0):i] for i in range(len(lines), 0, -args.n)
+    ][::-1]
+    prompts = []
+    for i, window in enumerate(windows, 1):
+        log_text = "\n".join(window)
+        log.debug("Window %d/%d, %d lines from file:\n%s",
+                  i, len(windows), len(window), log_text)
+        prompts.append(f"{prompt}\n\n{log_text}")
+        log.debug("Full prompt to send for window %d/%d:\n%s",
+                  i, len(windows), prompts[-1])
+
+    if args.s == 'ollama':
+        print(f'-> Sending {len(prompts)} POST requests to Ollama')
+        log.info("Sending %d POST requests to Ollama", len(prompts))
+        model = args.m
+        answers = asyncio.run(
+            ollama_generate_all(prompts, model, args.ip, args.p)
+        )
+    else:
+        api_key = get_openai_api_key()
+        if not api_key:
+            log.error("OpenAI API key not found in .env file.")
+            print("\nOpenAI API key not found in .env file.\n")
+            return
+        print(f'-> Sending {len(prompts)} POST requests to OpenAI')
+        log.info("Sending %d POST requests to OpenAI", len(prompts))
+        model = args.om
+        answers = asyncio.run(openai_complete_all(prompts, model, api_key))
 
+    for i, (window, answer) in enumerate(zip(windows, answers), 1):
+        if isinstance(answer, Exception) or not answer:
+            log.error("No response for window %d/%d: %s", i, len(windows), answer)
+            print(f"\nFailed to get a response for window {i}/{len(windows)}.\n")
+            continue
+        answer = answer.strip()
+        print_response_header(f"LLM RESPONSE (window {i}/{len(windows)}):")
+        print(answer)
+        print(SEP + "\n")
+        save_response_to_file(args.o, args.f, len(window), args.s, model, answer)
+
+def save_response_to_file(filename, log_filename, num_lines, system, model, answer):
+    record = (
+        f"Datetime: {datetime.now():%Y-%m-%d %H:%M:%S}\n"
+        f"Log Filename: {log_filename}\n"
+        f"Number of Lines Analyzed: {num_lines}\n"
+        f"System: {system}\n"
+        f"Model: {model}\n"
+        f"Answer:\n{answer}\n"
+        f"{SEP}\n\n"
+    )
+    with open(filename, 'a', encoding='utf-8') as f:
+        f.write(record)
+
+@functools.cache
+def build_parser():
     parser = argparse.ArgumentParser(
         description=(
             "Send a YAML-based prompt plus the last N lines from a file "
@@ -103,6 +434,16 @@ def main():
         default=10,
         help='Number of lines to read from file (default: 10)'
     )
+    parser.add_argument(
+        '-k',
+        type=int,
+        default=1,
+        help=(
+            'Number of consecutive N-line windows from the end of the file '
+            f'to analyze concurrently; at most {MAX_PARALLEL_REQUESTS} are '
+            'sent to the server at once (default: 1)'
+        )
+    )
     parser.add_argument(
         '-s',
         choices=['ollama', 'openai'],
@@ -119,86 +460,98 @@ def main():
         default='log-analyzer-output.txt',
         help='Output file to save the response (default: log-analyzer-output.txt)'
     )
-    args = parser.parse_args()
+    return parser
 
-    logging.info(
-        "Parsed arguments: file=%s, config=%s, ip=%s, port=%s, model=%s, lines=%d, server=%s, openai_model=%s, output=%s",
-        args.f, args.c, args.ip, args.p, args.m, args.n, args.s, args.om, args.o
-    )
+def main():
+    log.info("# Starting LLM log analyzer")
+    print('Starting the LLM log analyzer')
 
-    # Read the last N lines from the file
-    logging.info("Reading file: %s", args.f)
-    with open(args.f, "r", encoding="utf-8") as f:
-        lines = f.read().splitlines()
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.n < 1:
+        parser.error("-n must be at least 1")
+    if args.k < 1:
+        parser.error("-k must be at least 1")
 
-    if len(lines) > args.n:
-        last_n_lines = lines[-args.n:]
-    else:
-        last_n_lines = lines
+    log.info(
+        "Parsed arguments: file=%s, config=%s, ip=%s, port=%s, model=%s, lines=%d, windows=%d, server=%s, openai_model=%s, output=%s",
+        args.f, args.c, args.ip, args.p, args.m, args.n, args.k, args.s, args.om, args.o
+    )
 
-    logging.debug("Last %d lines from file:\n%s",
-                  args.n, "\n".join(last_n_lines))
+    # Read the last N lines (K windows of N lines with -k) from the file
+    log.info("Reading file: %s", args.f)
+    last_n_lines = tail_lines(args.f, args.n * args.k)
 
     # Read the YAML config (prompt)
-    logging.info("Reading config file: %s", args.c)
-    with open(args.c, "r", encoding="utf-8") as f:
-        config = yaml.safe_load(f)
+    log.info("Reading config file: %s", args.c)
+    config = load_yaml_cached(args.c)
 
     prompt = config.get("prompt", "")
-    logging.debug("Prompt from config:\n%s", prompt)
+    log.debug("Prompt from config:\n%s", prompt)
+
+    if args.k > 1 and not last_n_lines:
+        # No windows to split, so send the prompt once like -k 1 does
+        log.info("No lines to split into windows, sending a single prompt")
+    elif args.k > 1:
+        analyze_windows(args, prompt, last_n_lines)
+        log.info("Finished main function")
+        return
+
+    # Joined once and reused for both the debug log and the prompt
+    log_text = "\n".join(last_n_lines)
+    log.debug("Last %d lines from file:\n%s", args.n, log_text)
 
     # Combine prompt with the last N lines
-    full_prompt = f"{prompt}\n\n" + "\n".join(last_n_lines)
-    logging.debug("Full prompt to send:\n%s", full_prompt)
+    full_prompt = f"{prompt}\n\n{log_text}"
+    log.debug("Full prompt to send:\n%s", full_prompt)
 
     if args.s == 'ollama':
         print(f'-> Sending POST request to Ollama')
-        logging.info("Sending POST request to Ollama")
+        log.info("Sending POST request to Ollama")
         response = call_ollama(full_prompt, args.m, args.ip, args.p)
     else:
+        import asyncio
+
         print(f'-> Sending POST request to OpenAI')
-        logging.info("Sending POST request to OpenAI")
-        response = call_openai(full_prompt, args.om)
+        log.info("Sending POST request to OpenAI")
+        response = asyncio.run(
+            stream_openai_response(full_prompt, args.om, get_openai_api_key())
+        )
 
-    if response:
+    if response is not None:
         if args.s == 'ollama':
-            logging.debug("Response status: %d", response.status_code)
-            logging.debug("Response body:\n%s", response.text)
+            log.debug("Response status: %d", response.status_code)
+            log.debug("Response encoding: %s",
+                      response.headers.get("Content-Encoding", "identity"))
             if response.status_code == 200:
-                resp_data = response.json()
-                if "response" in resp_data:
-                    final_answer = resp_data["response"].strip()
-                else:
-                    logging.warning("No valid response field found.")
-                    print("\nNo valid response field found in the JSON.\n")
+                print_response_header()
+                final_answer = stream_ollama_response(response)
+                if final_answer is None:
                     return
+                final_answer = final_answer.strip()
+                print()
             else:
-                logging.error(
-                    "Error: %d - %s", response.status_code, response.text
+                # The body is streamed, so read only its first 2 KiB
+                body = truncate_body(
+                    next(response.iter_content(MAX_LOGGED_BODY), b"")
                 )
-                print(f"\nError: {response.status_code} - {response.text}\n")
+                response.close()
+                log.error("Error: %d - %s", response.status_code, body)
+                print(f"\nError: {response.status_code} - {body}\n")
                 return
         else:
-            if response.choices and len(response.choices) > 0:
-                final_answer = response.choices[0].message.content.strip()
-            else:
-                logging.warning("No valid response field found.")
-                print("\nNo valid response field found in the JSON.\n")
-                return
+            final_answer = response.strip()
+            print()
 
-        logging.info("Received valid response.")
-        print("\n" + "="*60)
-        print("LLM RESPONSE:")
-        print("="*60)
-        print(final_answer)
-        print("="*60 + "\n")
+        log.info("Received valid response.")
+        print(SEP + "\n")
 
         # Save the response to a file
         save_response_to_file(args.o, args.f, args.n, args.s, args.m if args.s == 'ollama' else args.om, final_answer)
     else:
-        logging.error("Failed to get a response from the server.")
+        log.error("Failed to get a response from the server.")
 
-    logging.info("Finished main function")
+    log.info("Finished main function")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file